@@ -49,17 +49,30 @@ class Buffer(dict):
             def extend(self, data):
                 """
                 Adds a list of np.arrays to the end of the list of np.arrays.
+                Double precision data is stored as float32.
                 :param data: The np.array list to append.
                 """
-                self += list(np.array(data))
+                self += list(self._to_float32(np.array(data)))
 
             def set(self, data):
                 """
-                Sets the list of np.array to the input data
+                Sets the list of np.array to the input data.
+                Double precision data is stored as float32.
                 :param data: The np.array list to be set.
                 """
                 self[:] = []
-                self[:] = list(np.array(data))
+                self[:] = list(self._to_float32(np.array(data)))
+
+            @staticmethod
+            def _to_float32(data):
+                """
+                Casts double precision data to float32, the precision of the model inputs, so
+                that it does not need to be converted every time it is fed to the model.
+                :param data: The np.array to cast.
+                """
+                if data.dtype == np.float64:
+                    return data.astype(np.float32)
+                return data
 
             def get_batch(self, batch_size=None, training_length=1, sequential=True):
                 """
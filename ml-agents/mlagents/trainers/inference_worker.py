@@ -0,0 +1,51 @@
+# # Unity ML-Agents Toolkit
+import threading
+from concurrent.futures import Future
+from queue import Queue
+
+
+class InferenceWorker:
+    """
+        Runs the action inference of a trainer on a dedicated thread. TensorFlow
+        releases the GIL while a session runs, so the inference of several brains
+        submitted to their own workers can run concurrently.
+    """
+    def __init__(self, get_action):
+        """
+        :param get_action: Function returning the ActionInfo for a BrainInfo, such as
+        Trainer.get_action.
+        """
+        self.get_action = get_action
+        self._requests = Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, brain_info) -> Future:
+        """
+        Queues a BrainInfo for inference.
+        :param brain_info: The BrainInfo to decide actions for.
+        :return: A Future which resolves to the ActionInfo for brain_info.
+        """
+        future = Future()
+        self._requests.put((brain_info, future))
+        return future
+
+    def close(self):
+        """
+        Stops the worker thread once the pending requests have been served.
+        """
+        self._requests.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            brain_info, future = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.get_action(brain_info))
+            except Exception as e:
+                future.set_exception(e)
@@ -90,6 +90,9 @@ class LearningModel(object):
                                                     dtype=tf.float32,
                                                     initializer=tf.ones_initializer())
             self.update_mean, self.update_variance = self.create_normalizer_update(self.vector_in)
+            # Both statistics are always updated together, so they are exposed as a single op
+            # which avoids copying the new values back to Python.
+            self.update_normalization = tf.group(self.update_mean, self.update_variance)
 
             self.normalized_state = tf.clip_by_value((self.vector_in - self.running_mean) / tf.sqrt(
                 self.running_variance / (tf.cast(self.global_step, tf.float32) + 1)), -5, 5,
@@ -45,11 +45,17 @@ class Policy(object):
         self.use_continuous_act = (brain.vector_action_space_type == "continuous")
         self.model_path = trainer_parameters["model_path"]
         self.keep_checkpoints = trainer_parameters.get("keep_checkpoints", 5)
+        self.use_xla = bool(trainer_parameters.get("use_xla", False))
         self.graph = tf.Graph()
         config = tf.ConfigProto()
         config.gpu_options.allow_growth = True
+        if self.use_xla:
+            # Session-level JIT lets XLA fuse the many small elementwise ops of the
+            # loss and optimizer graphs. It is only effective on GPU devices.
+            config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
         self.sess = tf.Session(config=config, graph=self.graph)
         self.saver = None
+        self._empty_mem_cache = None
         if self.use_recurrent:
             self.m_size = trainer_parameters["memory_size"]
             self.sequence_length = trainer_parameters["sequence_length"]
@@ -144,6 +150,18 @@ class Policy(object):
         """
         return np.zeros((num_agents, self.m_size))
 
+    def get_empty_memory(self, num_agents):
+        """
+        Returns empty memory for use with RNNs, sliced from a cached buffer of zeros
+        which only grows when more agents than previously seen are requested.
+        The returned array must not be modified in place.
+        :param num_agents: Number of agents.
+        :return: Numpy array of zeros.
+        """
+        if self._empty_mem_cache is None or self._empty_mem_cache.shape[0] < num_agents:
+            self._empty_mem_cache = np.zeros((num_agents, self.m_size), dtype=np.float32)
+        return self._empty_mem_cache[:num_agents]
+
     def get_current_step(self):
         """
         Gets current model step.
@@ -155,8 +173,9 @@ class Policy(object):
     def increment_step(self):
         """
         Increments model step.
+        :return: the incremented model step.
         """
-        self.sess.run(self.model.increment_step)
+        return self.sess.run(self.model.increment_step)
 
     def get_inference_vars(self):
         """
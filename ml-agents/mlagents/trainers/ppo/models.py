@@ -1,3 +1,4 @@
+import contextlib
 import logging
 import numpy as np
 
@@ -10,7 +11,7 @@ logger = logging.getLogger("mlagents.trainers")
 class PPOModel(LearningModel):
     def __init__(self, brain, lr=1e-4, h_size=128, epsilon=0.2, beta=1e-3, max_step=5e6,
                  normalize=False, use_recurrent=False, num_layers=2, m_size=None, use_curiosity=False,
-                 curiosity_strength=0.01, curiosity_enc_size=128, seed=0):
+                 curiosity_strength=0.01, curiosity_enc_size=128, seed=0, use_xla=False):
         """
         Takes a Unity environment and model-specific hyper-parameters and returns the
         appropriate PPO agent model for the environment.
@@ -25,6 +26,7 @@ class PPOModel(LearningModel):
         :param use_recurrent: Whether to use an LSTM layer in the network.
         :param num_layers Number of hidden layers between encoded input and policy & value layers
         :param m_size: Size of brain memory.
+        :param use_xla: Whether to compile the loss and optimizer ops with XLA.
         """
         LearningModel.__init__(self, m_size, normalize, use_recurrent, brain, seed)
         self.use_curiosity = use_curiosity
@@ -40,10 +42,24 @@ class PPOModel(LearningModel):
             self.curiosity_enc_size = curiosity_enc_size
             self.curiosity_strength = curiosity_strength
             encoded_state, encoded_next_state = self.create_curiosity_encoders()
-            self.create_inverse_model(encoded_state, encoded_next_state)
-            self.create_forward_model(encoded_state, encoded_next_state)
-        self.create_ppo_optimizer(self.log_probs, self.old_log_probs, self.value,
-                                  self.entropy, beta, epsilon, lr, max_step)
+        with self.create_jit_scope(use_xla):
+            if self.use_curiosity:
+                self.create_inverse_model(encoded_state, encoded_next_state)
+                self.create_forward_model(encoded_state, encoded_next_state)
+            self.create_ppo_optimizer(self.log_probs, self.old_log_probs, self.value,
+                                      self.entropy, beta, epsilon, lr, max_step)
+
+    @staticmethod
+    def create_jit_scope(use_xla):
+        """
+        Creates the scope in which the loss and optimizer ops are built, so that XLA
+        can fuse them (and their gradients) into a small number of kernels.
+        :param use_xla: Whether to mark the ops for XLA compilation.
+        :return: An XLA JIT scope, or an empty context if XLA is disabled.
+        """
+        if use_xla:
+            return tf.contrib.compiler.jit.experimental_jit_scope()
+        return contextlib.ExitStack()
 
     @staticmethod
     def create_reward_encoder():
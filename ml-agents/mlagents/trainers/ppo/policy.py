@@ -8,6 +8,8 @@ logger = logging.getLogger("mlagents.trainers")
 
 
 class PPOPolicy(Policy):
+    _noise_buffer_size = 8192
+
     def __init__(self, seed, brain, trainer_params, is_training, load):
         """
         Policy for Proximal Policy Optimization Networks.
@@ -35,7 +37,23 @@ class PPOPolicy(Policy):
                                   use_curiosity=bool(trainer_params['use_curiosity']),
                                   curiosity_strength=float(trainer_params['curiosity_strength']),
                                   curiosity_enc_size=float(trainer_params['curiosity_enc_size']),
-                                  seed=seed)
+                                  seed=seed,
+                                  use_xla=self.use_xla)
+
+        # These sizes are fixed for the lifetime of the policy, so they are computed
+        # once here rather than on every call to evaluate and update.
+        self._act_size_len = len(self.model.act_size)
+        self._sum_action_space = sum(self.model.act_size)
+        self._act0 = self.model.act_size[0]
+        self._act_shape = (-1, self._act_size_len)
+        if self.use_continuous_act:
+            # Each policy draws its action noise from its own generator, so that the noise
+            # does not depend on the order in which policies run on inference threads. Its
+            # seed is drawn from the seeded global generator, since all the policies of a
+            # run share the same seed and must not share the same noise.
+            self._random_state = np.random.RandomState(np.random.randint(2 ** 31))
+            self._noise_buf = np.empty((0, self._act0), dtype=np.float32)
+            self._noise_ptr = 0
 
         if load:
             self._load_graph()
@@ -50,8 +68,9 @@ class PPOPolicy(Policy):
         if self.use_recurrent:
             self.inference_dict['memory_out'] = self.model.memory_out
         if is_training and self.use_vec_obs and trainer_params['normalize']:
-            self.inference_dict['update_mean'] = self.model.update_mean
-            self.inference_dict['update_variance'] = self.model.update_variance
+            self.inference_dict['update_normalization'] = self.model.update_normalization
+        self._inference_keys = list(self.inference_dict.keys())
+        self._inference_tensors = list(self.inference_dict.values())
 
         self.update_dict = {'value_loss': self.model.value_loss,
                             'policy_loss': self.model.policy_loss,
@@ -60,32 +79,141 @@ class PPOPolicy(Policy):
             self.update_dict['forward_loss'] = self.model.forward_loss
             self.update_dict['inverse_loss'] = self.model.inverse_loss
 
+        # Per-step scalar fields of the mini batch which are fed as flat vectors.
+        self._flat_feed_plan = [(self.model.mask_input, 'masks'),
+                                (self.model.returns_holder, 'discounted_returns'),
+                                (self.model.old_value, 'value_estimates')]
+
+        # Visual observations of recurrent mini batches come in sequences which are merged
+        # into the batch dimension. Whether this is needed is fixed for the policy.
+        if self.use_recurrent and self.sequence_length > 1:
+            self._vis_reshape = lambda obs: obs.reshape(-1, obs.shape[-3], obs.shape[-2], obs.shape[-1])
+        else:
+            self._vis_reshape = lambda obs: obs
+        self._vis_keys = ['visual_obs%d' % i for i in range(self.model.vis_obs_size)]
+        self._next_vis_keys = ['next_visual_obs%d' % i for i in range(self.model.vis_obs_size)]
+
+        # The placeholders fed by evaluate and update only depend on the configuration
+        # of the policy, so the session callables are built once with a fixed feed order.
+        self._inference_feeders = self._create_inference_feeders()
+        self._inference_feed_list = [holder for holder, _ in self._inference_feeders]
+        if self.use_continuous_act:
+            self._epsilon_feed_index = next(i for i, holder in enumerate(self._inference_feed_list)
+                                            if holder is self.model.epsilon)
+        self._inference_callable = self.sess.make_callable(
+            self._inference_tensors, feed_list=self._inference_feed_list)
+
+        self._update_keys = list(self.update_dict.keys())
+        self._update_feeders = self._create_update_feeders()
+        self._update_feed_list = [self.model.batch_size, self.model.sequence_length]
+        self._update_feed_list += [holder for holder, _ in self._update_feeders]
+        self._update_callable = self.sess.make_callable(
+            list(self.update_dict.values()), feed_list=self._update_feed_list)
+
+    def _create_inference_feeders(self):
+        """
+        Creates the inputs of the inference step for the configuration of this policy.
+        Each feeder maps a BrainInfo to the array fed to its placeholder, so evaluate
+        does not need to branch on the configuration.
+        :return: List of (placeholder, feeder) pairs.
+        """
+        def visual(i):
+            return lambda brain_info: brain_info.visual_observations[i]
+
+        feeders = [(self.model.batch_size, lambda brain_info: len(brain_info.vector_observations)),
+                   (self.model.sequence_length, lambda brain_info: 1)]
+        feeders += [(visual_in, visual(i)) for i, visual_in in enumerate(self.model.visual_in)]
+        if self.use_vec_obs:
+            feeders.append((self.model.vector_in, lambda brain_info: brain_info.vector_observations))
+        if self.use_recurrent:
+            if not self.use_continuous_act:
+                feeders.append((self.model.prev_action,
+                                lambda brain_info: brain_info.previous_vector_actions.reshape(self._act_shape)))
+            feeders.append((self.model.memory_in, self._memory_feed))
+        if self.use_continuous_act:
+            feeders.append((self.model.epsilon,
+                            lambda brain_info: self._sample_epsilon(len(brain_info.vector_observations))))
+        else:
+            feeders.append((self.model.action_masks, lambda brain_info: brain_info.action_masks))
+        return feeders
+
+    def _create_update_feeders(self):
+        """
+        Creates the inputs of the update step for the configuration of this policy.
+        Each feeder maps a mini batch to the array fed to its placeholder, so update
+        does not need to branch on the configuration.
+        :return: List of (placeholder, feeder) pairs.
+        """
+        def flat(key):
+            return lambda mini_batch: mini_batch[key].ravel()
+
+        def reshaped(key, size):
+            return lambda mini_batch: mini_batch[key].reshape(-1, size)
+
+        def visual(key):
+            return lambda mini_batch: self._vis_reshape(mini_batch[key])
+
+        feeders = [(self.model.advantage, reshaped('advantages', 1)),
+                   (self.model.all_old_log_probs, reshaped('action_probs', self._sum_action_space))]
+        feeders += [(holder, flat(key)) for holder, key in self._flat_feed_plan]
+        if self.use_continuous_act:
+            feeders.append((self.model.output_pre, reshaped('actions_pre', self._act0)))
+            feeders.append((self.model.epsilon, reshaped('random_normal_epsilon', self._act0)))
+        else:
+            feeders.append((self.model.action_holder, reshaped('actions', self._act_size_len)))
+            if self.use_recurrent:
+                feeders.append((self.model.prev_action, reshaped('prev_action', self._act_size_len)))
+            feeders.append((self.model.action_masks, reshaped('action_mask', self._sum_action_space)))
+        if self.use_vec_obs:
+            feeders.append((self.model.vector_in, reshaped('vector_obs', self.vec_obs_size)))
+            if self.use_curiosity:
+                feeders.append((self.model.next_vector_in, reshaped('next_vector_in', self.vec_obs_size)))
+        feeders += [(visual_in, visual(key)) for visual_in, key in zip(self.model.visual_in, self._vis_keys)]
+        if self.use_curiosity and self.model.vis_obs_size > 0:
+            feeders += [(next_visual_in, visual(key))
+                        for next_visual_in, key in zip(self.model.next_visual_in, self._next_vis_keys)]
+        if self.use_recurrent:
+            feeders.append((self.model.memory_in, lambda mini_batch: mini_batch['memory'][:, 0, :]))
+        return feeders
+
+    def _memory_feed(self, brain_info):
+        """
+        Returns the memories fed to the inference step, initializing them if empty.
+        :param brain_info: BrainInfo object containing inputs.
+        :return: Array of memories.
+        """
+        if brain_info.memories.shape[1] == 0:
+            brain_info.memories = self.get_empty_memory(len(brain_info.agents))
+        return brain_info.memories
+
     def evaluate(self, brain_info):
         """
         Evaluates policy for the agent experiences provided.
         :param brain_info: BrainInfo object containing inputs.
         :return: Outputs from network as defined by self.inference_dict.
         """
-        feed_dict = {self.model.batch_size: len(brain_info.vector_observations),
-                     self.model.sequence_length: 1}
-        epsilon = None
-        if self.use_recurrent:
-            if not self.use_continuous_act:
-                feed_dict[self.model.prev_action] = brain_info.previous_vector_actions.reshape(
-                    [-1, len(self.model.act_size)])
-            if brain_info.memories.shape[1] == 0:
-                brain_info.memories = self.make_empty_memory(len(brain_info.agents))
-            feed_dict[self.model.memory_in] = brain_info.memories
-        if self.use_continuous_act:
-            epsilon = np.random.normal(
-                size=(len(brain_info.vector_observations), self.model.act_size[0]))
-            feed_dict[self.model.epsilon] = epsilon
-        feed_dict = self._fill_eval_dict(feed_dict, brain_info)
-        run_out = self._execute_model(feed_dict, self.inference_dict)
+        feeds = [feeder(brain_info) for _, feeder in self._inference_feeders]
+        run_out = dict(zip(self._inference_keys, self._inference_callable(*feeds)))
         if self.use_continuous_act:
-            run_out['random_normal_epsilon'] = epsilon
+            run_out['random_normal_epsilon'] = feeds[self._epsilon_feed_index]
         return run_out
 
+    def _sample_epsilon(self, num_agents):
+        """
+        Returns the Gaussian noise used to sample continuous actions. The noise is drawn in
+        large blocks and handed out in slices. An exhausted block is replaced rather than
+        refilled in place, since the slices are kept in the experience buffer.
+        :param num_agents: Number of agents to sample noise for.
+        :return: Array of noise of shape [num_agents, action size].
+        """
+        if self._noise_ptr + num_agents > len(self._noise_buf):
+            self._noise_buf = self._random_state.standard_normal(
+                (max(self._noise_buffer_size, num_agents), self._act0)).astype(np.float32)
+            self._noise_ptr = 0
+        epsilon = self._noise_buf[self._noise_ptr:self._noise_ptr + num_agents]
+        self._noise_ptr += num_agents
+        return epsilon
+
     def update(self, mini_batch, num_sequences):
         """
         Updates model using buffer.
@@ -93,54 +221,28 @@ class PPOPolicy(Policy):
         :param mini_batch: Experience batch.
         :return: Output from update process.
         """
-        feed_dict = {self.model.batch_size: num_sequences,
-                     self.model.sequence_length: self.sequence_length,
-                     self.model.mask_input: mini_batch['masks'].flatten(),
-                     self.model.returns_holder: mini_batch['discounted_returns'].flatten(),
-                     self.model.old_value: mini_batch['value_estimates'].flatten(),
-                     self.model.advantage: mini_batch['advantages'].reshape([-1, 1]),
-                     self.model.all_old_log_probs: mini_batch['action_probs'].reshape(
-                         [-1, sum(self.model.act_size)])}
-        if self.use_continuous_act:
-            feed_dict[self.model.output_pre] = mini_batch['actions_pre'].reshape(
-                [-1, self.model.act_size[0]])
-            feed_dict[self.model.epsilon] = mini_batch['random_normal_epsilon'].reshape(
-                [-1, self.model.act_size[0]])
-        else:
-            feed_dict[self.model.action_holder] = mini_batch['actions'].reshape(
-                [-1, len(self.model.act_size)])
-            if self.use_recurrent:
-                feed_dict[self.model.prev_action] = mini_batch['prev_action'].reshape(
-                    [-1, len(self.model.act_size)])
-            feed_dict[self.model.action_masks] = mini_batch['action_mask'].reshape(
-                [-1, sum(self.brain.vector_action_space_size)])
-        if self.use_vec_obs:
-            feed_dict[self.model.vector_in] = mini_batch['vector_obs'].reshape(
-                [-1, self.vec_obs_size])
-            if self.use_curiosity:
-                feed_dict[self.model.next_vector_in] = mini_batch['next_vector_in'].reshape(
-                    [-1, self.vec_obs_size])
-        if self.model.vis_obs_size > 0:
-            for i, _ in enumerate(self.model.visual_in):
-                _obs = mini_batch['visual_obs%d' % i]
-                if self.sequence_length > 1 and self.use_recurrent:
-                    (_batch, _seq, _w, _h, _c) = _obs.shape
-                    feed_dict[self.model.visual_in[i]] = _obs.reshape([-1, _w, _h, _c])
-                else:
-                    feed_dict[self.model.visual_in[i]] = _obs
-            if self.use_curiosity:
-                for i, _ in enumerate(self.model.visual_in):
-                    _obs = mini_batch['next_visual_obs%d' % i]
-                    if self.sequence_length > 1 and self.use_recurrent:
-                        (_batch, _seq, _w, _h, _c) = _obs.shape
-                        feed_dict[self.model.next_visual_in[i]] = _obs.reshape([-1, _w, _h, _c])
-                    else:
-                        feed_dict[self.model.next_visual_in[i]] = _obs
-        if self.use_recurrent:
-            mem_in = mini_batch['memory'][:, 0, :]
-            feed_dict[self.model.memory_in] = mem_in
+        return self.update_from_feeds(self.make_update_feeds(mini_batch, num_sequences))
+
+    def make_update_feeds(self, mini_batch, num_sequences):
+        """
+        Prepares the arrays fed to the update step, so they can be built ahead of time.
+        :param mini_batch: Experience batch.
+        :param num_sequences: Number of trajectories in batch.
+        :return: List of arrays in the order of the update placeholders.
+        """
+        feeds = [num_sequences, self.sequence_length]
+        feeds += [feeder(mini_batch) for _, feeder in self._update_feeders]
+        return feeds
+
+    def update_from_feeds(self, feeds):
+        """
+        Updates model using feeds prepared by make_update_feeds.
+        :param feeds: List of arrays in the order of the update placeholders.
+        :return: Output from update process.
+        """
         self.has_updated = True
-        run_out = self._execute_model(feed_dict, self.update_dict)
+        network_out = self._update_callable(*feeds)
+        run_out = dict(zip(self._update_keys, network_out))
         return run_out
 
     def get_intrinsic_rewards(self, curr_info, next_info):
@@ -168,7 +270,7 @@ class PPOPolicy(Policy):
                 feed_dict[self.model.next_vector_in] = next_info.vector_observations
             if self.use_recurrent:
                 if curr_info.memories.shape[1] == 0:
-                    curr_info.memories = self.make_empty_memory(len(curr_info.agents))
+                    curr_info.memories = self.get_empty_memory(len(curr_info.agents))
                 feed_dict[self.model.memory_in] = curr_info.memories
             intrinsic_rewards = self.sess.run(self.model.intrinsic_reward,
                                               feed_dict=feed_dict) * float(self.has_updated)
@@ -181,22 +283,31 @@ class PPOPolicy(Policy):
         Generates value estimates for bootstrapping.
         :param brain_info: BrainInfo to be used for bootstrapping.
         :param idx: Index in BrainInfo of agent.
-        :return: Value estimate.
+        :return: Value estimate, of shape [1, 1].
+        """
+        return self.get_value_estimates_batched(brain_info, [idx])
+
+    def get_value_estimates_batched(self, brain_info, idxs):
+        """
+        Generates value estimates for bootstrapping several agents with a single evaluation.
+        :param brain_info: BrainInfo to be used for bootstrapping.
+        :param idxs: List of indices in BrainInfo of the agents.
+        :return: Value estimates, of shape [len(idxs), 1].
         """
-        feed_dict = {self.model.batch_size: 1, self.model.sequence_length: 1}
+        feed_dict = {self.model.batch_size: len(idxs), self.model.sequence_length: 1}
         for i in range(len(brain_info.visual_observations)):
-            feed_dict[self.model.visual_in[i]] = [brain_info.visual_observations[i][idx]]
+            feed_dict[self.model.visual_in[i]] = [brain_info.visual_observations[i][idx] for idx in idxs]
         if self.use_vec_obs:
-            feed_dict[self.model.vector_in] = [brain_info.vector_observations[idx]]
+            feed_dict[self.model.vector_in] = brain_info.vector_observations[idxs]
         if self.use_recurrent:
             if brain_info.memories.shape[1] == 0:
-                brain_info.memories = self.make_empty_memory(len(brain_info.agents))
-            feed_dict[self.model.memory_in] = [brain_info.memories[idx]]
+                brain_info.memories = self.get_empty_memory(len(brain_info.agents))
+            feed_dict[self.model.memory_in] = brain_info.memories[idxs]
         if not self.use_continuous_act and self.use_recurrent:
-            feed_dict[self.model.prev_action] = brain_info.previous_vector_actions[idx].reshape(
-                [-1, len(self.model.act_size)])
-        value_estimate = self.sess.run(self.model.value, feed_dict)
-        return value_estimate
+            feed_dict[self.model.prev_action] = brain_info.previous_vector_actions[idxs].reshape(
+                self._act_shape)
+        value_estimates = self.sess.run(self.model.value, feed_dict)
+        return value_estimates
 
     def get_last_reward(self):
         """
@@ -212,3 +323,16 @@ class PPOPolicy(Policy):
         """
         self.sess.run(self.model.update_reward,
                       feed_dict={self.model.new_reward: new_reward})
+
+    def increment_step_and_update_reward(self, new_reward=None):
+        """
+        Increments model step and updates the reward value for policy, using a single
+        session run.
+        :param new_reward: New reward to save. If None, the reward is left unchanged.
+        :return: the incremented model step.
+        """
+        if new_reward is None:
+            return self.increment_step()
+        step, _ = self.sess.run([self.model.increment_step, self.model.update_reward],
+                                feed_dict={self.model.new_reward: new_reward})
+        return step
@@ -4,6 +4,7 @@
 
 import logging
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import tensorflow as tf
@@ -20,6 +21,9 @@ logger = logging.getLogger("mlagents.trainers")
 class PPOTrainer(Trainer):
     """The PPOTrainer is an implementation of the PPO algorithm."""
 
+    # Number of mini batches prepared ahead of the running update.
+    _prefetch_batches = 2
+
     def __init__(self, brain, reward_buff_cap, trainer_parameters, training,
                  load, seed, run_id):
         """
@@ -55,6 +59,9 @@ class PPOTrainer(Trainer):
         self.stats = stats
 
         self.training_buffer = Buffer()
+        # Buffer keys of the visual observations, built once instead of on every step.
+        self.visual_obs_keys = ['visual_obs%d' % i for i in range(brain.number_visual_observations)]
+        self.next_visual_obs_keys = ['next_visual_obs%d' % i for i in range(brain.number_visual_observations)]
         self.cumulative_rewards = {}
         self._reward_buffer = deque(maxlen=reward_buff_cap)
         self.episode_steps = {}
@@ -100,11 +107,10 @@ class PPOTrainer(Trainer):
         """
         Increment the step count of the trainer and Updates the last reward
         """
+        mean_reward = None
         if len(self.stats['Environment/Cumulative Reward']) > 0:
             mean_reward = np.mean(self.stats['Environment/Cumulative Reward'])
-            self.policy.update_reward(mean_reward)
-        self.policy.increment_step()
-        self.step = self.policy.get_current_step()
+        self.step = self.policy.increment_step_and_update_reward(mean_reward)
 
     def construct_curr_info(self, next_info: BrainInfo) -> BrainInfo:
         """
@@ -187,9 +193,9 @@ class PPOTrainer(Trainer):
                 next_idx = next_info.agents.index(agent_id)
                 if not stored_info.local_done[idx]:
                     for i, _ in enumerate(stored_info.visual_observations):
-                        self.training_buffer[agent_id]['visual_obs%d' % i].append(
+                        self.training_buffer[agent_id][self.visual_obs_keys[i]].append(
                             stored_info.visual_observations[i][idx])
-                        self.training_buffer[agent_id]['next_visual_obs%d' % i].append(
+                        self.training_buffer[agent_id][self.next_visual_obs_keys[i]].append(
                             next_info.visual_observations[i][next_idx])
                     if self.policy.use_vec_obs:
                         self.training_buffer[agent_id]['vector_obs'].append(stored_info.vector_observations[idx])
@@ -243,51 +249,59 @@ class PPOTrainer(Trainer):
         """
         self.trainer_metrics.start_experience_collection_timer()
         info = new_info[self.brain_name]
+        ready_agents = []
         for l in range(len(info.agents)):
             agent_actions = self.training_buffer[info.agents[l]]['actions']
             if ((info.local_done[l] or len(agent_actions) > self.trainer_parameters['time_horizon'])
                     and len(agent_actions) > 0):
-                agent_id = info.agents[l]
-                if info.local_done[l] and not info.max_reached[l]:
-                    value_next = 0.0
-                else:
-                    if info.max_reached[l]:
-                        bootstrapping_info = self.training_buffer[agent_id].last_brain_info
-                        idx = bootstrapping_info.agents.index(agent_id)
-                    else:
-                        bootstrapping_info = info
-                        idx = l
-                    value_next = self.policy.get_value_estimate(bootstrapping_info, idx)
-
-                self.training_buffer[agent_id]['advantages'].set(
-                    get_gae(
-                        rewards=self.training_buffer[agent_id]['rewards'].get_batch(),
-                        value_estimates=self.training_buffer[agent_id]['value_estimates'].get_batch(),
-                        value_next=value_next,
-                        gamma=self.trainer_parameters['gamma'],
-                        lambd=self.trainer_parameters['lambd']))
-                self.training_buffer[agent_id]['discounted_returns'].set(
-                    self.training_buffer[agent_id]['advantages'].get_batch()
-                    + self.training_buffer[agent_id]['value_estimates'].get_batch())
-
-                self.training_buffer.append_update_buffer(agent_id, batch_size=None,
-                                                          training_length=self.policy.sequence_length)
-
-                self.training_buffer[agent_id].reset_agent()
-                if info.local_done[l]:
-                    self.cumulative_returns_since_policy_update.append(self.
-                                                                       cumulative_rewards.get(agent_id, 0))
-                    self.stats['Environment/Cumulative Reward'].append(
-                        self.cumulative_rewards.get(agent_id, 0))
-                    self.reward_buffer.appendleft(self.cumulative_rewards.get(agent_id, 0))
-                    self.stats['Environment/Episode Length'].append(
-                        self.episode_steps.get(agent_id, 0))
-                    self.cumulative_rewards[agent_id] = 0
-                    self.episode_steps[agent_id] = 0
-                    if self.use_curiosity:
-                        self.stats['Policy/Curiosity Reward'].append(
-                            self.intrinsic_rewards.get(agent_id, 0))
-                        self.intrinsic_rewards[agent_id] = 0
+                ready_agents.append(l)
+        # Agents which are still running are bootstrapped from the current info, so their
+        # value estimates are computed together in a single evaluation.
+        bootstrap_idxs = [l for l in ready_agents if not info.local_done[l] and not info.max_reached[l]]
+        value_nexts = {}
+        if bootstrap_idxs:
+            value_estimates = self.policy.get_value_estimates_batched(info, bootstrap_idxs)
+            value_nexts = dict(zip(bootstrap_idxs, value_estimates[:, 0]))
+        for l in ready_agents:
+            agent_id = info.agents[l]
+            if info.local_done[l] and not info.max_reached[l]:
+                value_next = 0.0
+            elif info.max_reached[l]:
+                bootstrapping_info = self.training_buffer[agent_id].last_brain_info
+                idx = bootstrapping_info.agents.index(agent_id)
+                value_next = self.policy.get_value_estimate(bootstrapping_info, idx)[0, 0]
+            else:
+                value_next = value_nexts[l]
+
+            self.training_buffer[agent_id]['advantages'].set(
+                get_gae(
+                    rewards=self.training_buffer[agent_id]['rewards'].get_batch(),
+                    value_estimates=self.training_buffer[agent_id]['value_estimates'].get_batch(),
+                    value_next=value_next,
+                    gamma=self.trainer_parameters['gamma'],
+                    lambd=self.trainer_parameters['lambd']))
+            self.training_buffer[agent_id]['discounted_returns'].set(
+                self.training_buffer[agent_id]['advantages'].get_batch()
+                + self.training_buffer[agent_id]['value_estimates'].get_batch())
+
+            self.training_buffer.append_update_buffer(agent_id, batch_size=None,
+                                                      training_length=self.policy.sequence_length)
+
+            self.training_buffer[agent_id].reset_agent()
+            if info.local_done[l]:
+                self.cumulative_returns_since_policy_update.append(self.
+                                                                   cumulative_rewards.get(agent_id, 0))
+                self.stats['Environment/Cumulative Reward'].append(
+                    self.cumulative_rewards.get(agent_id, 0))
+                self.reward_buffer.appendleft(self.cumulative_rewards.get(agent_id, 0))
+                self.stats['Environment/Episode Length'].append(
+                    self.episode_steps.get(agent_id, 0))
+                self.cumulative_rewards[agent_id] = 0
+                self.episode_steps[agent_id] = 0
+                if self.use_curiosity:
+                    self.stats['Policy/Curiosity Reward'].append(
+                        self.intrinsic_rewards.get(agent_id, 0))
+                    self.intrinsic_rewards[agent_id] = 0
         self.trainer_metrics.end_experience_collection_timer()
 
     def end_episode(self):
@@ -325,18 +339,15 @@ class PPOTrainer(Trainer):
         self.training_buffer.update_buffer['advantages'].set(
             (advantages - advantages.mean()) / (advantages.std() + 1e-10))
         num_epoch = self.trainer_parameters['num_epoch']
-        for _ in range(num_epoch):
-            self.training_buffer.update_buffer.shuffle()
-            buffer = self.training_buffer.update_buffer
-            for l in range(len(self.training_buffer.update_buffer['actions']) // n_sequences):
-                start = l * n_sequences
-                end = (l + 1) * n_sequences
-                run_out = self.policy.update(buffer.make_mini_batch(start, end), n_sequences)
-                value_total.append(run_out['value_loss'])
-                policy_total.append(np.abs(run_out['policy_loss']))
-                if self.use_curiosity:
-                    inverse_total.append(run_out['inverse_loss'])
-                    forward_total.append(run_out['forward_loss'])
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for _ in range(num_epoch):
+                self.training_buffer.update_buffer.shuffle()
+                for run_out in self._run_epoch_updates(executor, n_sequences):
+                    value_total.append(run_out['value_loss'])
+                    policy_total.append(np.abs(run_out['policy_loss']))
+                    if self.use_curiosity:
+                        inverse_total.append(run_out['inverse_loss'])
+                        forward_total.append(run_out['forward_loss'])
         self.stats['Losses/Value Loss'].append(np.mean(value_total))
         self.stats['Losses/Policy Loss'].append(np.mean(policy_total))
         if self.use_curiosity:
@@ -345,6 +356,29 @@ class PPOTrainer(Trainer):
         self.training_buffer.reset_update_buffer()
         self.trainer_metrics.end_policy_update()
 
+    def _run_epoch_updates(self, executor, n_sequences):
+        """
+        Runs the policy updates of one epoch over the update buffer. The feeds of the next
+        mini batches are prepared on the executor while the current update runs.
+        :param executor: Executor preparing the mini batch feeds.
+        :param n_sequences: Number of sequences in a mini batch.
+        :return: Generator of the outputs of the update process.
+        """
+        buffer = self.training_buffer.update_buffer
+
+        def prepare(start):
+            mini_batch = buffer.make_mini_batch(start, start + n_sequences)
+            return self.policy.make_update_feeds(mini_batch, n_sequences)
+
+        pending = deque()
+        for l in range(len(buffer['actions']) // n_sequences):
+            pending.append(executor.submit(prepare, l * n_sequences))
+            if len(pending) > self._prefetch_batches:
+                yield self.policy.update_from_feeds(pending.popleft().result())
+        while pending:
+            yield self.policy.update_from_feeds(pending.popleft().result())
+
+
 def discount_rewards(r, gamma=0.99, value_next=0.0):
     """
     Computes discounted sum of future rewards for use in updating value estimate.
@@ -43,3 +43,16 @@ def test_buffer():
     c = b.update_buffer.make_mini_batch(start=0, end=1)
     assert c.keys() == b.update_buffer.keys()
     assert c['action'].shape == (1, 2, 2)
+
+
+def test_buffer_stores_double_precision_as_float32():
+    b = Buffer()
+    for step in range(4):
+        b[0]['rewards'].append(0.5 * step)
+        b[0]['actions'].append([step, step + 1])
+    b.append_update_buffer(0, batch_size=None, training_length=1)
+    c = b.update_buffer.make_mini_batch(start=0, end=4)
+    assert c['rewards'].dtype == np.float32
+    assert c['actions'].dtype.kind == 'i'
+    b[0]['advantages'].set(np.array([0.1, 0.2, 0.3, 0.4]))
+    assert b[0]['advantages'].get_batch().dtype == np.float32
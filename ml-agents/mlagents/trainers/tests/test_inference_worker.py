@@ -0,0 +1,25 @@
+import pytest
+from unittest.mock import MagicMock
+
+from mlagents.trainers import ActionInfo
+from mlagents.trainers.inference_worker import InferenceWorker
+
+
+def test_submit_returns_action_info():
+    action_info = ActionInfo('action', 'memory', None, 'value', {})
+    get_action = MagicMock(return_value=action_info)
+    worker = InferenceWorker(get_action)
+    brain_info = MagicMock()
+    future = worker.submit(brain_info)
+    assert future.result(timeout=5) == action_info
+    get_action.assert_called_once_with(brain_info)
+    worker.close()
+
+
+def test_submit_propagates_exceptions():
+    get_action = MagicMock(side_effect=ValueError('bad brain info'))
+    worker = InferenceWorker(get_action)
+    future = worker.submit(MagicMock())
+    with pytest.raises(ValueError):
+        future.result(timeout=5)
+    worker.close()
@@ -1,5 +1,5 @@
 from mlagents.trainers.policy import *
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 def basic_mock_brain():
     mock_brain = MagicMock()
@@ -49,3 +49,39 @@ def test_take_action_returns_action_info_when_available():
         policy_eval_out
     )
     assert (result == expected)
+
+
+def test_get_empty_memory_reuses_cached_buffer():
+    test_seed = 3
+    params = basic_params()
+    policy = Policy(test_seed, basic_mock_brain(), params)
+    policy.m_size = 8
+    memory = policy.get_empty_memory(4)
+    assert memory.shape == (4, 8)
+    assert not memory.any()
+    smaller = policy.get_empty_memory(2)
+    assert smaller.shape == (2, 8)
+    assert np.shares_memory(memory, smaller)
+    larger = policy.get_empty_memory(6)
+    assert larger.shape == (6, 8)
+    assert not larger.any()
+
+
+def test_xla_sets_session_jit_level():
+    test_seed = 3
+    params = basic_params()
+    params['use_xla'] = True
+    with patch('tensorflow.Session') as session_mock:
+        policy = Policy(test_seed, basic_mock_brain(), params)
+    assert policy.use_xla
+    config = session_mock.call_args[1]['config']
+    assert config.graph_options.optimizer_options.global_jit_level == tf.OptimizerOptions.ON_1
+
+
+def test_xla_is_disabled_by_default():
+    test_seed = 3
+    with patch('tensorflow.Session') as session_mock:
+        policy = Policy(test_seed, basic_mock_brain(), basic_params())
+    assert not policy.use_xla
+    config = session_mock.call_args[1]['config']
+    assert config.graph_options.optimizer_options.global_jit_level != tf.OptimizerOptions.ON_1
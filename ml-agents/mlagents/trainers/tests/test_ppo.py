@@ -5,10 +5,11 @@ import numpy as np
 import tensorflow as tf
 import yaml
 
+from mlagents.trainers.buffer import Buffer
 from mlagents.trainers.ppo.models import PPOModel
-from mlagents.trainers.ppo.trainer import discount_rewards
+from mlagents.trainers.ppo.trainer import PPOTrainer, discount_rewards, get_gae
 from mlagents.trainers.ppo.policy import PPOPolicy
-from mlagents.envs import UnityEnvironment
+from mlagents.envs import UnityEnvironment, BrainInfo
 from mlagents.envs.mock_communicator import MockCommunicator
 
 
@@ -40,6 +41,45 @@ def dummy_config():
         ''')
 
 
+def create_ppo_policy(mock_communicator, dummy_config, discrete_action=False, visual_inputs=0,
+                      use_recurrent=False, use_curiosity=False):
+    tf.reset_default_graph()
+    mock_communicator.return_value = MockCommunicator(
+        discrete_action=discrete_action, visual_inputs=visual_inputs)
+    env = UnityEnvironment(' ')
+    brain = env.brains[env.brain_names[0]]
+    env.close()
+
+    trainer_parameters = dummy_config
+    trainer_parameters['model_path'] = env.brain_names[0]
+    trainer_parameters['keep_checkpoints'] = 3
+    trainer_parameters['use_recurrent'] = use_recurrent
+    trainer_parameters['sequence_length'] = 4
+    trainer_parameters['use_curiosity'] = use_curiosity
+    return PPOPolicy(0, brain, trainer_parameters, False, False)
+
+
+def create_brain_info(brain, num_agents=3, memory_size=0):
+    visual_observations = [[np.random.rand(res['height'], res['width'], 1 if res['blackAndWhite'] else 3)
+                            for _ in range(num_agents)] for res in brain.camera_resolutions]
+    vector_observations = np.random.rand(
+        num_agents, brain.vector_observation_space_size * brain.num_stacked_vector_observations)
+    if brain.vector_action_space_type == 'continuous':
+        previous_actions = np.random.rand(num_agents, brain.vector_action_space_size[0])
+    else:
+        previous_actions = np.stack([np.random.randint(0, size, num_agents)
+                                     for size in brain.vector_action_space_size], axis=1)
+    return BrainInfo(visual_observations, vector_observations, [''] * num_agents,
+                     memory=np.random.rand(num_agents, memory_size),
+                     reward=[0.0] * num_agents,
+                     agents=list(range(num_agents)),
+                     local_done=[False] * num_agents,
+                     vector_action=previous_actions,
+                     text_action=[[] for _ in range(num_agents)],
+                     max_reached=[False] * num_agents,
+                     action_mask=np.ones((num_agents, sum(brain.vector_action_space_size))))
+
+
 @mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
 @mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
 def test_ppo_policy_evaluate(mock_communicator, mock_launcher, dummy_config):
@@ -57,9 +97,46 @@ def test_ppo_policy_evaluate(mock_communicator, mock_launcher, dummy_config):
     policy = PPOPolicy(0, env.brains[env.brain_names[0]], trainer_parameters, False, False)
     run_out = policy.evaluate(brain_info)
     assert run_out['action'].shape == (3, 2)
+    assert run_out['random_normal_epsilon'].shape == (3, 2)
     env.close()
 
 
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_evaluate_continuous_recurrent(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config, use_recurrent=True)
+    brain_info = create_brain_info(policy.brain)
+    run_out = policy.evaluate(brain_info)
+    assert run_out['action'].shape == (3, 2)
+    assert run_out['random_normal_epsilon'].shape == (3, 2)
+    assert run_out['memory_out'].shape == (3, 8)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_evaluate_discrete_recurrent(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config, discrete_action=True, use_recurrent=True)
+    brain_info = create_brain_info(policy.brain)
+    run_out = policy.evaluate(brain_info)
+    assert run_out['action'].shape == (3, 1)
+    assert run_out['memory_out'].shape == (3, 8)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_sample_epsilon(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config)
+    policy._noise_buffer_size = 4
+    first = policy._sample_epsilon(3)
+    assert first.shape == (3, 2)
+    assert first.dtype == np.float32
+    first_copy = first.copy()
+    second = policy._sample_epsilon(3)
+    assert second.shape == (3, 2)
+    np.testing.assert_array_equal(first, first_copy)
+    assert policy._sample_epsilon(6).shape == (6, 2)
+
+
 @mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
 @mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
 def test_ppo_model_cc_vector(mock_communicator, mock_launcher):
@@ -334,6 +411,344 @@ def test_ppo_model_cc_visual_curio(mock_communicator, mock_launcher):
             env.close()
 
 
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_increment_step_and_update_reward(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config)
+    step = policy.increment_step_and_update_reward(2.5)
+    assert step == policy.get_current_step() == 1
+    assert policy.get_last_reward() == 2.5
+    step = policy.increment_step_and_update_reward()
+    assert step == policy.get_current_step() == 2
+    assert policy.get_last_reward() == 2.5
+
+
+def create_inference_feed_dict(policy, brain_info, epsilon):
+    model = policy.model
+    feed_dict = {model.batch_size: len(brain_info.vector_observations),
+                 model.sequence_length: 1}
+    if policy.use_recurrent:
+        if not policy.use_continuous_act:
+            feed_dict[model.prev_action] = brain_info.previous_vector_actions.reshape(
+                [-1, len(model.act_size)])
+        feed_dict[model.memory_in] = brain_info.memories
+    if policy.use_continuous_act:
+        feed_dict[model.epsilon] = epsilon
+    for i, _ in enumerate(brain_info.visual_observations):
+        feed_dict[model.visual_in[i]] = brain_info.visual_observations[i]
+    if policy.use_vec_obs:
+        feed_dict[model.vector_in] = brain_info.vector_observations
+    if not policy.use_continuous_act:
+        feed_dict[model.action_masks] = brain_info.action_masks
+    return feed_dict
+
+
+def check_evaluate_matches_feed_dict(policy):
+    brain_info = create_brain_info(policy.brain, memory_size=policy.m_size or 0)
+    run_out = policy.evaluate(brain_info)
+    expected = policy.sess.run(policy.inference_dict, feed_dict=create_inference_feed_dict(
+        policy, brain_info, run_out.get('random_normal_epsilon')))
+    # Discrete actions are sampled in the graph, so they differ between runs.
+    names = ['value', 'log_probs', 'entropy']
+    if policy.use_continuous_act:
+        names += ['action', 'pre_action']
+    if policy.use_recurrent:
+        names.append('memory_out')
+    for name in names:
+        np.testing.assert_allclose(run_out[name], expected[name], rtol=1e-5, atol=1e-6)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_evaluate_matches_feed_dict_continuous(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config)
+    check_evaluate_matches_feed_dict(policy)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_evaluate_matches_feed_dict_continuous_recurrent(mock_communicator, mock_launcher,
+                                                                    dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config, use_recurrent=True)
+    check_evaluate_matches_feed_dict(policy)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_evaluate_matches_feed_dict_discrete_visual(mock_communicator, mock_launcher,
+                                                               dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config, discrete_action=True, visual_inputs=2)
+    check_evaluate_matches_feed_dict(policy)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_evaluate_matches_feed_dict_discrete_recurrent(mock_communicator, mock_launcher,
+                                                                  dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config, discrete_action=True, use_recurrent=True)
+    check_evaluate_matches_feed_dict(policy)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policies_with_same_seed_draw_different_noise(mock_communicator, mock_launcher, dummy_config):
+    np.random.seed(0)
+    policy = create_ppo_policy(mock_communicator, dummy_config)
+    other_policy = create_ppo_policy(mock_communicator, dummy_config)
+    assert policy.seed == other_policy.seed
+    epsilon = policy._sample_epsilon(3)
+    assert not np.array_equal(epsilon, other_policy._sample_epsilon(3))
+
+    np.random.seed(0)
+    same_policy = create_ppo_policy(mock_communicator, dummy_config)
+    np.testing.assert_array_equal(epsilon, same_policy._sample_epsilon(3))
+
+
+def check_value_estimates_batched(policy):
+    brain_info = create_brain_info(policy.brain, memory_size=policy.m_size or 0)
+    idxs = [0, 2]
+    batched = policy.get_value_estimates_batched(brain_info, idxs)
+    assert batched.shape == (2, 1)
+    for row, idx in enumerate(idxs):
+        single = policy.get_value_estimate(brain_info, idx)
+        assert single.shape == (1, 1)
+        np.testing.assert_allclose(batched[row, 0], single[0, 0], rtol=1e-5)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_value_estimates_batched_vector(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config)
+    check_value_estimates_batched(policy)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_value_estimates_batched_visual(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config, discrete_action=True, visual_inputs=2)
+    check_value_estimates_batched(policy)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_value_estimates_batched_recurrent(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config, discrete_action=True, use_recurrent=True)
+    check_value_estimates_batched(policy)
+
+
+def create_mini_batch(policy, num_steps=8):
+    brain = policy.brain
+    act_size = brain.vector_action_space_size
+    buffer = Buffer()
+    agent_buffer = buffer[0]
+    for _ in range(num_steps):
+        for i, res in enumerate(brain.camera_resolutions):
+            shape = (res['height'], res['width'], 1 if res['blackAndWhite'] else 3)
+            agent_buffer['visual_obs%d' % i].append(np.random.rand(*shape))
+            agent_buffer['next_visual_obs%d' % i].append(np.random.rand(*shape))
+        agent_buffer['vector_obs'].append(np.random.rand(policy.vec_obs_size))
+        agent_buffer['next_vector_in'].append(np.random.rand(policy.vec_obs_size))
+        if policy.use_recurrent:
+            agent_buffer['memory'].append(np.random.rand(policy.m_size))
+        if policy.use_continuous_act:
+            agent_buffer['actions'].append(np.random.rand(act_size[0]))
+            agent_buffer['actions_pre'].append(np.random.rand(act_size[0]))
+            agent_buffer['random_normal_epsilon'].append(np.random.normal(size=act_size[0]))
+        else:
+            agent_buffer['actions'].append(np.array([np.random.randint(size) for size in act_size]))
+            agent_buffer['prev_action'].append(np.array([np.random.randint(size) for size in act_size]))
+            agent_buffer['action_mask'].append(np.ones(sum(act_size)), padding_value=1)
+        agent_buffer['action_probs'].append(np.random.rand(sum(act_size)))
+        agent_buffer['masks'].append(1.0)
+        agent_buffer['value_estimates'].append(np.random.rand())
+        agent_buffer['advantages'].append(np.random.rand())
+        agent_buffer['discounted_returns'].append(np.random.rand())
+    buffer.append_update_buffer(0, batch_size=None, training_length=policy.sequence_length)
+    num_sequences = len(buffer.update_buffer['actions'])
+    return buffer.update_buffer.make_mini_batch(0, num_sequences), num_sequences
+
+
+def create_update_feed_dict(policy, mini_batch, num_sequences):
+    model = policy.model
+    feed_dict = {model.batch_size: num_sequences,
+                 model.sequence_length: policy.sequence_length,
+                 model.mask_input: mini_batch['masks'].flatten(),
+                 model.returns_holder: mini_batch['discounted_returns'].flatten(),
+                 model.old_value: mini_batch['value_estimates'].flatten(),
+                 model.advantage: mini_batch['advantages'].reshape([-1, 1]),
+                 model.all_old_log_probs: mini_batch['action_probs'].reshape([-1, sum(model.act_size)])}
+    if policy.use_continuous_act:
+        feed_dict[model.output_pre] = mini_batch['actions_pre'].reshape([-1, model.act_size[0]])
+        feed_dict[model.epsilon] = mini_batch['random_normal_epsilon'].reshape([-1, model.act_size[0]])
+    else:
+        feed_dict[model.action_holder] = mini_batch['actions'].reshape([-1, len(model.act_size)])
+        if policy.use_recurrent:
+            feed_dict[model.prev_action] = mini_batch['prev_action'].reshape([-1, len(model.act_size)])
+        feed_dict[model.action_masks] = mini_batch['action_mask'].reshape([-1, sum(model.act_size)])
+    if policy.use_vec_obs:
+        feed_dict[model.vector_in] = mini_batch['vector_obs'].reshape([-1, policy.vec_obs_size])
+        if policy.use_curiosity:
+            feed_dict[model.next_vector_in] = mini_batch['next_vector_in'].reshape([-1, policy.vec_obs_size])
+    for i, _ in enumerate(model.visual_in):
+        obs = mini_batch['visual_obs%d' % i]
+        feed_dict[model.visual_in[i]] = obs.reshape([-1] + list(obs.shape[-3:]))
+        if policy.use_curiosity:
+            next_obs = mini_batch['next_visual_obs%d' % i]
+            feed_dict[model.next_visual_in[i]] = next_obs.reshape([-1] + list(next_obs.shape[-3:]))
+    if policy.use_recurrent:
+        feed_dict[model.memory_in] = mini_batch['memory'][:, 0, :]
+    return feed_dict
+
+
+def check_update_matches_feed_dict(policy):
+    mini_batch, num_sequences = create_mini_batch(policy)
+    loss_names = [name for name in policy.update_dict if name != 'update_batch']
+    expected = policy.sess.run([policy.update_dict[name] for name in loss_names],
+                               feed_dict=create_update_feed_dict(policy, mini_batch, num_sequences))
+    run_out = policy.update(mini_batch, num_sequences)
+    for name, expected_loss in zip(loss_names, expected):
+        assert np.all(np.isfinite(run_out[name]))
+        np.testing.assert_allclose(run_out[name], expected_loss, rtol=1e-5, atol=1e-6)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_update_continuous(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config)
+    check_update_matches_feed_dict(policy)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_update_discrete(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config, discrete_action=True)
+    check_update_matches_feed_dict(policy)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_update_discrete_recurrent(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config, discrete_action=True, visual_inputs=1,
+                               use_recurrent=True)
+    check_update_matches_feed_dict(policy)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_policy_update_visual_curiosity(mock_communicator, mock_launcher, dummy_config):
+    policy = create_ppo_policy(mock_communicator, dummy_config, discrete_action=True, visual_inputs=2,
+                               use_curiosity=True)
+    check_update_matches_feed_dict(policy)
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_model_xla_marks_loss_ops(mock_communicator, mock_launcher):
+    tf.reset_default_graph()
+    mock_communicator.return_value = MockCommunicator(
+        discrete_action=False, visual_inputs=0)
+    env = UnityEnvironment(' ')
+    model = PPOModel(env.brains["RealFakeBrain"], use_curiosity=True, use_xla=True)
+    for loss in [model.value_loss, model.policy_loss, model.forward_loss, model.inverse_loss]:
+        assert loss.op.get_attr('_XlaCompile')
+    with pytest.raises(ValueError):
+        model.value.op.get_attr('_XlaCompile')
+    env.close()
+
+
+def create_ppo_trainer(mock_communicator, dummy_config, tmpdir):
+    mock_communicator.return_value = MockCommunicator(
+        discrete_action=False, visual_inputs=0)
+    env = UnityEnvironment(' ')
+    brain = env.brains[env.brain_names[0]]
+    env.close()
+
+    trainer_parameters = dummy_config
+    trainer_parameters['model_path'] = str(tmpdir.join('model'))
+    trainer_parameters['summary_path'] = str(tmpdir.join('summaries'))
+    with mock.patch('mlagents.trainers.ppo.trainer.PPOPolicy'):
+        trainer = PPOTrainer(brain, 0, trainer_parameters, True, False, 0, '0')
+    trainer.policy.sequence_length = 1
+    return trainer, brain
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_trainer_update_policy_runs_each_mini_batch_once_per_epoch(mock_communicator, mock_launcher,
+                                                                       dummy_config, tmpdir):
+    trainer, _ = create_ppo_trainer(mock_communicator, dummy_config, tmpdir)
+    trainer.trainer_parameters['batch_size'] = 2
+    trainer.trainer_parameters['num_epoch'] = 3
+    trainer.cumulative_returns_since_policy_update = [1.0]
+    update_buffer = trainer.training_buffer.update_buffer
+    update_buffer['ids'].extend(np.arange(6))
+    update_buffer['actions'].extend(np.zeros((6, 2)))
+    update_buffer['advantages'].extend(np.arange(6, dtype=np.float32))
+
+    epoch_orders = []
+    shuffle = update_buffer.shuffle
+
+    def record_shuffle(key_list=None):
+        shuffle(key_list)
+        epoch_orders.append(list(update_buffer['ids']))
+    update_buffer.shuffle = record_shuffle
+
+    updated = []
+
+    def update_from_feeds(mini_batch):
+        updated.append(list(mini_batch['ids']))
+        loss = float(mini_batch['ids'][0])
+        return {'value_loss': loss, 'policy_loss': -loss}
+    trainer.policy.make_update_feeds.side_effect = lambda mini_batch, num_sequences: mini_batch
+    trainer.policy.update_from_feeds.side_effect = update_from_feeds
+    trainer.update_policy()
+
+    assert len(epoch_orders) == 3
+    expected = [order[start:start + 2] for order in epoch_orders for start in range(0, 6, 2)]
+    assert updated == expected
+    losses = [float(mini_batch[0]) for mini_batch in expected]
+    assert trainer.stats['Losses/Value Loss'] == [np.mean(losses)]
+    assert trainer.stats['Losses/Policy Loss'] == [np.mean(losses)]
+    assert len(update_buffer['ids']) == 0
+
+
+@mock.patch('mlagents.envs.UnityEnvironment.executable_launcher')
+@mock.patch('mlagents.envs.UnityEnvironment.get_communicator')
+def test_ppo_trainer_process_experiences_bootstraps_values(mock_communicator, mock_launcher,
+                                                           dummy_config, tmpdir):
+    trainer, brain = create_ppo_trainer(mock_communicator, dummy_config, tmpdir)
+    trainer.trainer_parameters['time_horizon'] = 2
+    info = create_brain_info(brain, num_agents=4)
+    # Agent 0 is done, agent 1 reached its max step and agents 2 and 3 are still running.
+    info.local_done = [True, True, False, False]
+    info.max_reached = [False, True, False, False]
+    last_info = create_brain_info(brain, num_agents=4)
+    for l, agent_id in enumerate(info.agents):
+        agent_buffer = trainer.training_buffer[agent_id]
+        for step in range(3):
+            agent_buffer['actions'].append(np.zeros(2))
+            agent_buffer['rewards'].append(float(l + step))
+            agent_buffer['value_estimates'].append(0.1 * (l + 1))
+    trainer.training_buffer[info.agents[1]].last_brain_info = last_info
+    trainer.policy.get_value_estimate.return_value = np.array([[2.0]])
+    trainer.policy.get_value_estimates_batched.return_value = np.array([[3.0], [4.0]])
+
+    trainer.process_experiences({brain.brain_name: info}, {brain.brain_name: info})
+
+    trainer.policy.get_value_estimate.assert_called_once_with(last_info, 1)
+    trainer.policy.get_value_estimates_batched.assert_called_once_with(info, [2, 3])
+    value_nexts = [0.0, 2.0, 3.0, 4.0]
+    expected = np.concatenate([
+        get_gae(rewards=np.array([l + step for step in range(3)], dtype=np.float64),
+                value_estimates=np.full(3, 0.1 * (l + 1)),
+                value_next=value_nexts[l],
+                gamma=trainer.trainer_parameters['gamma'],
+                lambd=trainer.trainer_parameters['lambd'])
+        for l in range(4)])
+    np.testing.assert_allclose(trainer.training_buffer.update_buffer['advantages'].get_batch(), expected,
+                               rtol=1e-5)
+
+
 def test_rl_functions():
     rewards = np.array([0.0, 0.0, 0.0, 1.0])
     gamma = 0.9
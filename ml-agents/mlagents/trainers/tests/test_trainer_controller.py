@@ -430,3 +430,57 @@ def test_take_step_adds_experiences_to_trainer_and_trains():
     trainer_mock.update_policy.assert_called_once()
     trainer_mock.write_summary.assert_called_once()
     trainer_mock.increment_step_and_update_last_reward.assert_called_once()
+
+
+def test_take_step_runs_inference_of_multiple_trainers_on_workers():
+    tc, trainer_mock = trainer_controller_with_take_step_mocks()
+    other_trainer_mock = MagicMock()
+    other_trainer_mock.get_step = 0
+    other_trainer_mock.get_max_steps = 5
+    tc.trainers['otherbrain'] = other_trainer_mock
+
+    brain_info_mock = MagicMock()
+    other_brain_info_mock = MagicMock()
+    curr_info = {'testbrain': brain_info_mock, 'otherbrain': other_brain_info_mock}
+    trainer_mock.is_ready_update = MagicMock(return_value=False)
+    other_trainer_mock.is_ready_update = MagicMock(return_value=False)
+
+    env_mock = MagicMock()
+    env_step_output_mock = MagicMock()
+    env_mock.step = MagicMock(return_value=env_step_output_mock)
+    env_mock.global_done = False
+
+    action_output_mock = ActionInfo('action', 'memory', 'actiontext', 'value', {'some': 'output'})
+    other_action_output_mock = ActionInfo('other_action', 'other_memory', 'other_actiontext',
+                                          'other_value', {'other': 'output'})
+    trainer_mock.get_action = MagicMock(return_value=action_output_mock)
+    other_trainer_mock.get_action = MagicMock(return_value=other_action_output_mock)
+
+    tc.take_step(env_mock, curr_info)
+    assert set(tc.inference_workers.keys()) == {'testbrain', 'otherbrain'}
+    trainer_mock.get_action.assert_called_once_with(brain_info_mock)
+    other_trainer_mock.get_action.assert_called_once_with(other_brain_info_mock)
+    env_mock.step.assert_called_once_with(
+        vector_action={'testbrain': 'action', 'otherbrain': 'other_action'},
+        memory={'testbrain': 'memory', 'otherbrain': 'other_memory'},
+        text_action={'testbrain': 'actiontext', 'otherbrain': 'other_actiontext'},
+        value={'testbrain': 'value', 'otherbrain': 'other_value'}
+    )
+    trainer_mock.add_experiences.assert_called_once_with(
+        curr_info, env_step_output_mock, action_output_mock.outputs)
+    other_trainer_mock.add_experiences.assert_called_once_with(
+        curr_info, env_step_output_mock, other_action_output_mock.outputs)
+    tc._close_inference_workers()
+    assert tc.inference_workers == {}
+
+
+@patch('tensorflow.reset_default_graph')
+def test_start_learning_closes_inference_workers_on_error(tf_reset_graph):
+    tc, trainer_mock = trainer_controller_with_start_learning_mocks()
+    tc.take_step.side_effect = RuntimeError('failed step')
+    tc._close_inference_workers = MagicMock()
+
+    env_mock = MagicMock()
+    with pytest.raises(RuntimeError):
+        tc.start_learning(env_mock, dummy_config())
+    tc._close_inference_workers.assert_called_once()
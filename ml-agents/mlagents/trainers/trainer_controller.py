@@ -16,6 +16,7 @@ from mlagents.envs import AllBrainInfo, BrainParameters
 from mlagents.envs.base_unity_environment import BaseUnityEnvironment
 from mlagents.envs.exception import UnityEnvironmentException
 from mlagents.trainers import Trainer
+from mlagents.trainers.inference_worker import InferenceWorker
 from mlagents.trainers.ppo.trainer import PPOTrainer
 from mlagents.trainers.bc.offline_trainer import OfflineBCTrainer
 from mlagents.trainers.bc.online_trainer import OnlineBCTrainer
@@ -63,6 +64,7 @@ class TrainerController(object):
         self.keep_checkpoints = keep_checkpoints
         self.trainers: Dict[str, Trainer] = {}
         self.trainer_metrics: Dict[str, TrainerMetrics] = {}
+        self.inference_workers: Dict[str, InferenceWorker] = {}
         self.global_step = 0
         self.meta_curriculum = meta_curriculum
         self.seed = training_seed
@@ -229,11 +231,23 @@ class TrainerController(object):
             if self.train_model:
                 self._save_model_when_interrupted(steps=self.global_step)
             pass
+        finally:
+            self._close_inference_workers()
         env.close()
         if self.train_model:
             self._write_training_metrics()
             self._export_graph()
 
+    def _get_inference_worker(self, brain_name: str) -> InferenceWorker:
+        if brain_name not in self.inference_workers:
+            self.inference_workers[brain_name] = InferenceWorker(self.trainers[brain_name].get_action)
+        return self.inference_workers[brain_name]
+
+    def _close_inference_workers(self):
+        for worker in self.inference_workers.values():
+            worker.close()
+        self.inference_workers = {}
+
     def take_step(self, env: BaseUnityEnvironment, curr_info: AllBrainInfo):
         if self.meta_curriculum:
             # Get the sizes of the reward buffers.
@@ -269,8 +283,15 @@ class TrainerController(object):
         take_action_text = {}
         take_action_value = {}
         take_action_outputs = {}
-        for brain_name, trainer in self.trainers.items():
-            action_info = trainer.get_action(curr_info[brain_name])
+        if len(self.trainers) > 1:
+            # Run the inference of all the brains concurrently.
+            futures = {brain_name: self._get_inference_worker(brain_name).submit(curr_info[brain_name])
+                       for brain_name in self.trainers}
+            action_infos = {brain_name: future.result() for brain_name, future in futures.items()}
+        else:
+            action_infos = {brain_name: trainer.get_action(curr_info[brain_name])
+                            for brain_name, trainer in self.trainers.items()}
+        for brain_name, action_info in action_infos.items():
             take_action_vector[brain_name] = action_info.action
             take_action_memories[brain_name] = action_info.memory
             take_action_text[brain_name] = action_info.text